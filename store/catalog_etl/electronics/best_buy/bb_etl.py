@@ -1,13 +1,20 @@
 import os
 import sys
-import json
+import asyncio
 import time
 import logging
 from datetime import datetime
+from urllib.parse import quote_plus
 
 import numpy as np
-import pandas as pd
-import pyodbc
+import orjson
+import pyarrow as pa
+try:
+    from fastmssql import Connection, PoolConfig
+except ImportError:
+    # without fastmssql, load_to_sql() uploads through SQLAlchemy and pyodbc
+    Connection = None
+    import sqlalchemy
 
 from bb_sql import *
 
@@ -37,44 +44,58 @@ def configure_logging(path_to_log_directory, log_level='WARNING'):
     return logger
 
 # main functions
-def extract(data_directory, subset=None):
+def extract(data_directory, subset=None, dtypes=None):
     """
     Main function to extract all relevant content from files, databases, etc.
     
+    Args:
+        data_directory (str): directory which stores all NDJSON outputs.
+        subset (list): defines which product fields to keep.
+        dtypes (dict): defines the target dtypes, used to build the parse schema.
+    
+    Without a subset every field's type is inferred by pyarrow, so each field must hold one kind of value
+    across all files (ints and floats may mix, strings and numbers may not). Pass a subset to have values converted.
+    
     Returns: List of Products
     """
-    products = get_template(data_directory)
-    if subset:
-        products = products[subset].copy()
-    
-    for file in os.listdir(data_directory):
-        if '.json' in file:
-            brand, results = read_json(os.path.join(data_directory, file))
-            results_df = pd.DataFrame.from_dict(results)
-            results_df['brand'] = brand
-            
-            if subset:
-                results_df = results_df[subset]
-
-            products = pd.concat([products, results_df]).reset_index(drop=True)
+    schema = get_product_schema(subset, dtypes) if subset else None
+    files = [file for file in os.listdir(data_directory) if file.endswith('.ndjson')]
+    
+    # empty table with the expected columns, in case no files are read
+    template = (schema or pa.schema([])).empty_table()
+    
+    # collect each file's table and convert to pandas once at the end, widening ints to floats where files differ
+    tables = [template]
+    for file in files:
+        tables.append(read_ndjson(os.path.join(data_directory, file), schema))
+    
+    products = pa.concat_tables(tables, promote_options='permissive').to_pandas()
         
     return products
 
-def read_json(file_path):
+def read_ndjson(file_path, schema=None):
     """
-    Retrieves data from JSON file.
+    Retrieves a brand's products from its NDJSON file, one product per line.
     
-    Returns: list of json objects
-    """
+    Args:
+        file_path (str): defines the NDJSON file to read.
+        schema (pa.Schema): defines the product fields and types to convert to, inferred when not given.
     
+    Returns: pa.Table of products
+    """
     try:
         print('Extracting Data From: %s' % file_path)
-        with open(file_path, 'r') as readfile:
-            results = json.load(readfile)
-            return results.get('brand', None), results.get('results', [])
+        with open(file_path, 'rb') as readfile:
+            products = [orjson.loads(line) for line in readfile if line.strip()]
+        
+        # only the schema's fields are converted, so fields the ETL never reads cannot break the parse
+        if schema is not None:
+            return cast_to_schema(products, schema)
+            
+        return pa.Table.from_pylist(products)
     except Exception as e:
         logger.error('type="parse" | file="%s"' % file_path)
-        return []
+        raise
 
 def transform(data, dtypes):
     """
@@ -88,17 +109,22 @@ def transform(data, dtypes):
     
     print('Transforming Data.')
     
+    # drop incomplete rows
+    data = data.dropna(subset=['brand', 'sku', 'salePrice', 'highResImage'], how='any')
+    
     # drop duplicates
-    data = data.drop_duplicates(subset=['brand', 'sku']).reset_index(drop=True)
+    data = data.drop_duplicates(subset=['brand', 'sku'], ignore_index=True)
     
     # fill missing data
-    data = data.dropna(subset=['brand', 'sku', 'salePrice', 'highResImage'], how='any').reset_index(drop=True)
-    data['salePrice'] = data['salePrice'].fillna(99999)
-    data['shortDescription'] = data['shortDescription'].fillna('')
-    data['categoryName'] = data['categoryName'].fillna('Other')
-    data['customerRating'] = data['customerRating'].fillna(0)
-    data['customerRatingCount'] = data['customerRatingCount'].fillna(0)
-    data['customerReviewCount'] = data['customerReviewCount'].fillna(0)
+    fill_values = {
+                   'salePrice': 99999,
+                   'shortDescription': '',
+                   'categoryName': 'Other',
+                   'customerRating': 0,
+                   'customerRatingCount': 0,
+                   'customerReviewCount': 0,
+                  }
+    data = data.fillna(fill_values)
 
     # Rename Columns
     rename_dict = {
@@ -108,8 +134,7 @@ def transform(data, dtypes):
     data = data.rename(columns=rename_dict)
     
     # set dtypes
-    for column, dtype in dtypes.items():
-        data[column] = data[column].astype(dtype)
+    data = data.astype(dtypes, copy=False)
         
     return data
 
@@ -127,32 +152,75 @@ def validate(data, dtypes):
     
     # ensure datatypes match up to what was defined
     for column, dtype in zip(data.columns, data.dtypes.values):
-        logger.error('type="validation" | message="%s to %s"' % (column, str(dtype)))
-        assert dtypes[column] == dtype
+        if dtypes[column] != dtype:
+            logger.error('type="validation" | message="%s is %s, expected %s"' % (column, str(dtype), str(dtypes[column])))
+            raise AssertionError(column)
         
     print('Succesfully Validated Data.')
     
 
 # helper functions
-def get_template(data_directory):
+def get_product_schema(columns, dtypes=None):
+    """
+    Builds the Arrow schema used to convert product fields from the NDJSON files.
+    
+    Args:
+        columns (list): defines which product fields to parse.
+        dtypes (dict): defines the target dtypes, numeric columns are built as float64 so missing values stay null.
+    
+    Returns: pa.Schema
     """
-    Get DataFrame Template
+    dtypes = dtypes or {}
+    fields = []
+    for column in columns:
+        if dtypes.get(column, np.dtype('object')).kind in 'fi':
+            fields.append(pa.field(column, pa.float64()))
+        else:
+            fields.append(pa.field(column, pa.string()))
+            
+    return pa.schema(fields)
+
+def cast_to_schema(products, schema):
+    """
+    Builds a table of the schema's fields from a list of json objects, converting each value to the field's type.
     
     Args:
-        data_directory: directory which stores all JSON outputs.
+        products (list): list of json objects.
+        schema (pa.Schema): defines the product fields and types to keep, missing values are left null.
     
-    Returns: Empty pd.DataFrame
+    Returns: pa.Table
     """
-    file_path = os.path.join(data_directory, os.listdir(data_directory)[0])
-    _, results = read_json(file_path)
+    columns = []
+    for field in schema:
+        values = [product.get(field.name) for product in products]
+        
+        # numeric skus become strings and quoted prices become floats
+        if pa.types.is_floating(field.type):
+            values = [None if value is None else float(value) for value in values]
+        else:
+            values = [None if value is None else str(value) for value in values]
+        columns.append(pa.array(values, field.type))
+            
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def get_row_placeholders(row_count, column_count):
+    """
+    Creates the VALUES placeholders for a multi-row INSERT statement.
     
-    product_template = pd.DataFrame.from_dict(results)
-    product_template['brand'] = None
-    product_template = product_template.drop(product_template.index)
+    Args:
+        row_count (int): defines the number of rows in the statement.
+        column_count (int): defines the number of columns in each row.
     
-    return product_template
+    Returns: str
+    """
+    rows = []
+    for row_index in range(row_count):
+        offset = row_index * column_count
+        rows.append(','.join(['@P%s' % (offset + index + 1) for index in range(column_count)]))
+        
+    return '), ('.join(rows)
 
-def load(data, database, table, column_map):
+async def load(data, database, table, column_map):
     """
     Main function to prepare database table and upload the data.
     
@@ -167,55 +235,94 @@ def load(data, database, table, column_map):
     
     print('Importing data into [%s].dbo.[%s]' % (database, table))
     
-    # cursor object
-    cursor = conn.cursor()
-    
     # query parameters
     data_columns = [column[0] for column in column_map]
     table_columns = ['[%s]' % column[1] for column in column_map]
-    column_placeholders = ['?' for _ in table_columns]
+    rows_per_insert = min(max_insert_rows, max_insert_parameters // len(table_columns))
     
-    # truncate
-    try:
-        TRUNCATE_SQL = TRUNCATE_SQL % DATABASE
-        print(TRUNCATE_SQL)
-        cursor.execute(TRUNCATE_SQL)
-    except pyodbc.ProgrammingError as e:
-        logger.error('type="sql" | message="Unable to find table %s.dbo.%s"' % (database, table))
-        raise Exception('Unable to find table %s.dbo.%s' % (database, table))
-    
-    # insert
-    try:
-        insert_params = [tuple([row[column] for column in data_columns]) for _, row in data.to_dict(orient='index').items()]
-        INSERT_SQL = INSERT_SQL % (database, table,
-                                  ', '.join(table_columns),
-                                  ','.join(column_placeholders),
-                                  )
-        print(INSERT_SQL)
-        cursor.executemany(INSERT_SQL, insert_params)
-    except pyodbc.ProgrammingError as e:
-        logger.error('type="sql" | message="Unable to import data into %s.dbo.%s"' % (database, table))
-        raise Exception('Unable to import data into %s.dbo.%s' % (database, table))
-    
-    # commit
-    print('Committing Changes.')
-    conn.commit()
+    # a single pooled connection, so the truncate and every insert run in one transaction
+    async with Connection(connection_string, pool_config=PoolConfig(max_size=1, min_idle=1)) as conn:
+        await conn.execute(BEGIN_TRANSACTION_SQL)
+        try:
+            # truncate
+            try:
+                truncate_sql = TRUNCATE_SQL % database
+                print(truncate_sql)
+                await conn.execute(truncate_sql)
+            except Exception as e:
+                logger.error('type="sql" | message="Unable to find table %s.dbo.%s"' % (database, table))
+                raise Exception('Unable to find table %s.dbo.%s' % (database, table))
+        
+            # insert, merging rows into multi-row statements
+            try:
+                # missing values are sent as None so they are written as NULL, as load_to_sql() does
+                insert_data = data[data_columns].astype(object)
+                insert_data = insert_data.where(data[data_columns].notna(), None)
+                insert_params = list(insert_data.itertuples(index=False, name=None))
+                print('Inserting %s rows, %s per statement.' % (len(insert_params), rows_per_insert))
+                
+                # the transaction is bound to one session, so statements are sent one at a time
+                for start in range(0, len(insert_params), rows_per_insert):
+                    rows = insert_params[start:start + rows_per_insert]
+                    insert_sql = INSERT_SQL % (database,
+                                               ', '.join(table_columns),
+                                               get_row_placeholders(len(rows), len(table_columns)),
+                                               )
+                    await conn.execute(insert_sql, [value for row in rows for value in row])
+            except Exception as e:
+                logger.error('type="sql" | message="Unable to import data into %s.dbo.%s"' % (database, table))
+                raise Exception('Unable to import data into %s.dbo.%s' % (database, table))
+        except Exception as e:
+            await conn.execute(ROLLBACK_TRANSACTION_SQL)
+            raise
+        
+        # commit
+        print('Committing Changes.')
+        await conn.execute(COMMIT_TRANSACTION_SQL)
 
-    # close connection
-    conn.close()
+def load_to_sql(data, database, table, column_map):
+    """
+    Fallback to load() for environments without fastmssql, uploading through pandas.to_sql over SQLAlchemy.
+    
+    Args:
+        data (pd.DataFrame): defines the data that is being validated.
+        database (str): defines database we are uploading to.
+        table (str): defines the table we are uploading to.
+        column_map [(df.col, db.Col)]: Used to map pd.DataFrame column to respective column in the table.
+        
+    Returns: None
+    """
+    
+    print('Importing data into [%s].dbo.[%s]' % (database, table))
+    
+    # query parameters
+    data_columns = [column[0] for column in column_map]
+    rows_per_insert = min(max_insert_rows, max_insert_parameters // len(column_map))
+    
+    with sa_engine.begin() as conn:
+        # truncate
+        try:
+            truncate_sql = TRUNCATE_SQL % database
+            print(truncate_sql)
+            conn.exec_driver_sql(truncate_sql)
+        except Exception as e:
+            logger.error('type="sql" | message="Unable to find table %s.dbo.%s"' % (database, table))
+            raise Exception('Unable to find table %s.dbo.%s' % (database, table))
+        
+        # insert, as multi-row statements built straight from the DataFrame columns,
+        # into the same [database].Electronics table that TRUNCATE_SQL and INSERT_SQL target
+        try:
+            data[data_columns].rename(columns=dict(column_map)).to_sql('Electronics', conn, schema=database, if_exists='append',
+                                                                       index=False, method='multi',
+                                                                       chunksize=rows_per_insert)
+        except Exception as e:
+            logger.error('type="sql" | message="Unable to import data into %s.dbo.%s"' % (database, table))
+            raise Exception('Unable to import data into %s.dbo.%s' % (database, table))
 
     
 if __name__ == '__main__':
     start_time = time.time()
     
-    # get data
-    column_subset = ['brand', 'sku', 'categoryName', 'highResImage', 
-                    'regularPrice', 'salePrice', 'shortDescription', 
-                     'customerRating', 'customerRatingCount', 
-                     'customerReviewCount', 'productUrl',
-                    ]
-    products = extract(data_directory, subset=column_subset)
-
     # define dtypes
     dtypes = {
                   'brand': np.dtype('object'), 
@@ -231,6 +338,14 @@ if __name__ == '__main__':
                   'productUrl': np.dtype('object')
              }
 
+    # get data
+    column_subset = ['brand', 'sku', 'categoryName', 'highResImage', 
+                    'regularPrice', 'salePrice', 'shortDescription', 
+                     'customerRating', 'customerRatingCount', 
+                     'customerReviewCount', 'productUrl',
+                    ]
+    products = extract(data_directory, subset=column_subset, dtypes=dtypes)
+
     # transform
     products = transform(products, dtypes)
 
@@ -251,7 +366,10 @@ if __name__ == '__main__':
                   ('productUrl', 'SourceUrl'),
                  ]
         
-    load(data=data, database=DATABASE, table=TABLE_NAME, column_map=column_map)
+    if Connection is None:
+        load_to_sql(data=products, database=DATABASE, table=TABLE_NAME, column_map=column_map)
+    else:
+        asyncio.run(load(data=products, database=DATABASE, table=TABLE_NAME, column_map=column_map))
     
     end_time = time.time()
     
@@ -280,8 +398,14 @@ except KeyError as e:
     logger.error('type="ENV_VARIABLE" | message="Failed to get %s"' % e)
     raise Exception(e)
 
-connection_string = 'DRIVER={%s};SERVER=%s;DATABASE=%s;UID=%s;PWD=%s' % (DRIVER, HOST, DATABASE, USERNAME, PASSWORD)
+connection_string = 'Server=%s;Database=%s;User Id=%s;Password=%s' % (HOST, DATABASE, USERNAME, PASSWORD)
 
-# establish connection
-conn = pyodbc.connect(connection_string)
-    
+# SQL Server allows at most 2100 parameters and 1000 VALUES rows per statement
+max_insert_parameters = 2000
+max_insert_rows = 1000
+
+# fallback engine for load_to_sql()
+if Connection is None:
+    odbc_connection_string = 'DRIVER={%s};SERVER=%s;DATABASE=%s;UID=%s;PWD=%s' % (DRIVER, HOST, DATABASE, USERNAME, PASSWORD)
+    sa_engine = sqlalchemy.create_engine('mssql+pyodbc:///?odbc_connect=' + quote_plus(odbc_connection_string),
+                                         fast_executemany=True)
@@ -1,19 +1,20 @@
 import os
 import sys
 
+import hashlib
+import importlib.util
 import json
 import logging
 import math
 import re
 import time
 
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from queue import Queue
-from threading import Thread
 
-import requests
-from bs4 import BeautifulSoup
+import orjson
+import httpx
+from selectolax.lexbor import LexborHTMLParser
 
 def configure_logging(path_to_log_directory, log_level='WARNING'):
     """
@@ -40,27 +41,30 @@ def configure_logging(path_to_log_directory, log_level='WARNING'):
     
     return logger
 
-def write_products_to_json(file_path, products):
+def write_products_to_ndjson(outfile, products, brand):
     """
-    Writes product data into JSON file.
+    Appends product data to an open NDJSON file, one product per line.
     
     Args:
-        file_path (str): defines the JSON path to store data contents.
+        outfile (file): defines the binary file the brand's products are written to.
         products (list): list of products we want to store.
+        brand (str): defines the brand recorded on every product.
     """
-    with open(file_path, 'w+') as outfile:
-        json.dump({'results': products}, outfile)
+    for product in products:
+        outfile.write(orjson.dumps(dict(product, brand=brand)) + b'\n')
         
-def get_headers(referer):
+def get_brand_file_name(brand):
     """
-    Creates a copy of the base_headers with an updated referer.
+    Creates a filesystem-safe NDJSON file name for a brand.
     
     Args:
-        referer (str): used to update header field that defines where the requests are from.
+        brand (str): defines the brand name as scraped from the site.
+    
+    Returns: str
     """
-    headers = deepcopy(base_headers)
-    headers['referer'] = referer
-    return headers
+    # the hash keeps names unique when brands only differ by stripped characters
+    brand_hash = hashlib.sha1(brand.encode('utf-8')).hexdigest()[:8]
+    return '%s_%s.ndjson' % (unsafe_filename_pattern.sub('', brand), brand_hash)
 
 def get_params(page_index, brand):
     """
@@ -97,76 +101,76 @@ def get_brands_reference(request_delay=request_delay):
     brands_reference = {}
     
     # make initial request
-    response = requests.get(home_page, headers=base_headers)
-    soup = BeautifulSoup(response.content)
+    response = http_client.get(home_page)
+    tree = LexborHTMLParser(response.content)
     
     if response.status_code not in acceptable_status_codes:
         logger.error('Failed to Connect to %s' % home_page)
 
-    for brandContainer in soup.find_all(class_=re.compile("brandGroup")):  # className contains: brandGroup
-        for link in brandContainer.find_all('a'):
-            try:
-                brand, url = link.text, link.get('href')
-                if brand != '' and url:
-                    brands_reference[brand] = url
-            except ValueError as e:
-                logger.warning('Unable to Parse: %s' % link)
+    for link in tree.css('[class*="brandGroup"] a'):  # className contains: brandGroup
+        try:
+            brand, url = link.text(), link.attributes.get('href')
+            if brand != '' and url:
+                brands_reference[brand] = url
+        except ValueError as e:
+            logger.warning('Unable to Parse: %s' % link.html)
                 
     return brands_reference
 
-def get_products_via_api(brand='ACER', init_url='https://www.bestbuy.ca/en-ca/brand/acer', request_delay=request_delay):
+def get_products_via_api(brand='ACER', init_url='https://www.bestbuy.ca/en-ca/brand/acer', request_delay=request_delay,
+                         client=None):
     """
-    Uses the API service to retrieve products and then writes the data to a directory in JSON format.
+    Uses the API service to retrieve products and then writes the data to a single NDJSON file per brand.
     
     Args:
         brand (str) : defines which brand we want to retrieve products for.
         init_url (str): url used to initialize session.
         request_delay (int): seconds in between each request.
+        client (httpx.Client): defines the client to make requests with, defaults to the shared http_client.
     """
     
     print('Downloading Products for %s' % brand)
 
-    session = requests.session()
+    if client is None:
+        client = http_client
 
-    _ = response = session.get(home_page, headers=base_headers)
+    _ = response = client.get(home_page)
     time.sleep(request_delay)
 
-    headers = get_headers(referer=home_page)
-    response = session.get(init_url, headers=headers)
+    response = client.get(init_url, headers={'referer': home_page})
 
     if response.status_code in acceptable_status_codes:
-        for page_index in range(1, 100):
-            print(page_index)
-            time.sleep(request_delay)
-
-            # request parameters
-            params = get_params(page_index=page_index, brand=brand)
-            headers = get_headers(referer=init_url)
-
-            response = session.get(api_page, headers=headers, params=params)
-
-            if response.status_code in acceptable_status_codes:
-                try:
-                    # write products to file
-                    products = response.json().get('products', [])
-                    if len(products) > 0:
-                        file_path = os.path.join(data_directory, '%s_%s.json' % (brand.replace(' ', ''), 
-                                                                                 str(page_index)))
-                        write_products_to_json(file_path, products)
-
-                    # break if page_index has exceeded page count
-                    total_pages = response.json().get('totalPages', 1)
-                    if page_index >= total_pages:
-                        print('Completed: %s' % brand)
+        # one file per brand, appended to across all pages
+        file_path = os.path.join(data_directory, get_brand_file_name(brand))
+        with open(file_path, 'wb') as outfile:
+            for page_index in range(1, 100):
+                print(page_index)
+                time.sleep(request_delay)
+
+                # request parameters
+                params = get_params(page_index=page_index, brand=brand)
+
+                response = client.get(api_page, params=params, headers={'referer': init_url})
+
+                if response.status_code in acceptable_status_codes:
+                    try:
+                        # write products to file
+                        products = response.json().get('products', [])
+                        write_products_to_ndjson(outfile, products, brand)
+
+                        # break if page_index has exceeded page count
+                        total_pages = response.json().get('totalPages', 1)
+                        if page_index >= total_pages:
+                            print('Completed: %s' % brand)
+                            break
+
+                    except json.decoder.JSONDecodeError as e:
+                        logger.warning('Failed to get content from %s' % response.url)
                         break
-
-                except json.decoder.JSONDecodeError as e:
-                    logger.warning('Failed to get content from %s' % response.url)
-                    break
-            else:
-                logger.warning('Failed to connect to %s' % response.url)
+                else:
+                    logger.warning('Failed to connect to %s' % response.url)
             
-            print('Completed: %s - %s/%s' % (brand, page_index, total_pages)) 
+                print('Completed: %s - %s/%s' % (brand, page_index, total_pages)) 
 
     else:
         print(response.status_code)
@@ -178,43 +182,51 @@ def get_products_on_page(page):
     Gets all products from the page.
     
     Args:
-        page (): defines the seconds in between requests.
+        page (LexborHTMLParser): defines the parsed page to read products from.
     """
     
     # get page count
     results_per_page = 24
     try:
-        result_count = float(re.sub('[^\d]', '', 
-                              soup.find('div', text=re.compile('results')).text))
+        results_text = next((div.text() for div in page.css('div')
+                             if results_pattern.search(div.text(deep=False))), '')
+        result_count = float(non_digit_pattern.sub('', results_text))
         page_count = math.ceil(result_count / results_per_page)
     except ValueError as e:
         page_count = 1
     
     # get products on page
-    product_results = page.find_all(class_=re.compile('productLine'))
+    product_results = page.css('[class*="productLine"]')
     products = []
 
     # parse products and page count
     for product in product_results:
         # optional content
         try:
-            review_content = product.find(class_=re.compile('review'))
-            rating = review_content.find('meta', {'itemprop': 'ratingValue'})['content']
-            review = review_content.find('span', {'itemprop': 'ratingCount'}).text
-            promo = product.find(class_=re.compile('productSaving')).text
+            review_content = product.css_first('[class*="review"]')
+            rating = review_content.css_first('meta[itemprop="ratingValue"]').attributes['content']
+            review = review_content.css_first('span[itemprop="ratingCount"]').text()
+            promo = product.css_first('[class*="productSaving"]').text()
         except AttributeError as e:
             rating = None
             review = None
             promo = None
 
-        url, price, name = (product.find('a', {'itemprop': 'url'})['href'],
-                            product.find('meta', {'itemprop': 'price'})['content'],
-                            product.find(itemprop='name').text,
+        url, price, name = (product.css_first('a[itemprop="url"]').attributes['href'],
+                            product.css_first('meta[itemprop="price"]').attributes['content'],
+                            product.css_first('[itemprop="name"]').text(),
                            )
         products.append([url, price, name, rating, review, promo])
     return products
 
-def download_all_products(brand_subset=None, threads=1):
+def download_all_products(brand_subset=None, threads=4):
+    """
+    Downloads the products for every brand, spreading the brands across a pool of worker threads.
+    
+    Args:
+        brand_subset (list): defines which brands to download, defaults to all brands.
+        threads (int): defines the number of brands downloaded at once.
+    """
     brand_reference = get_brands_reference()
     
     if brand_subset:
@@ -224,9 +236,10 @@ def download_all_products(brand_subset=None, threads=1):
     else:
         brand_reference = {brand.upper(): domain + url_extension for brand, url_extension in brand_reference.items()}
     
-    # putting into queue
-    for brand, brand_page in brand_reference.items():
-        get_products_via_api(brand=brand, init_url=brand_page)        
+    # workers share the pooled http_client and each keeps its own request delay
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda brand_item: get_products_via_api(brand=brand_item[0], init_url=brand_item[1]),
+                          brand_reference.items()))
 
 
 # date prefix
@@ -243,6 +256,13 @@ data_directory = 'data/%s' % date_string
 # seconds between requests
 request_delay = 1
 
+# page parsing patterns
+results_pattern = re.compile('results')
+non_digit_pattern = re.compile(r'[^\d]')
+
+# characters stripped from brand file names
+unsafe_filename_pattern = re.compile(r'[^\w-]')
+
 # allowable requests
 acceptable_status_codes = [200]
 
@@ -256,6 +276,12 @@ base_headers = {
     'authority': 'www.bestbuy.ca',
 }
 
+# HTTP/2 needs the optional h2 package (httpx[http2]), otherwise fall back to HTTP/1.1
+http2_enabled = importlib.util.find_spec('h2') is not None
+
+# shared client, pooling keep-alive connections across pages, brands and worker threads
+http_client = httpx.Client(http2=http2_enabled, follow_redirects=True, headers=base_headers, timeout=10.0)
+
 # create folder if it does not exist
 if not os.path.isdir(data_directory):
     os.mkdir(data_directory)
@@ -49,3 +49,15 @@ INSERT INTO [%s].Electronics (%s)
 VALUES (%s)
 """
 
+BEGIN_TRANSACTION_SQL = """
+SET XACT_ABORT ON;
+BEGIN TRANSACTION;
+"""
+
+COMMIT_TRANSACTION_SQL = """
+COMMIT TRANSACTION;
+"""
+
+ROLLBACK_TRANSACTION_SQL = """
+IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION;
+"""
@@ -1,8 +1,15 @@
 import os
 import sys
+import asyncio
 import logging
+from urllib.parse import quote_plus
 
-import pyodbc
+try:
+    from fastmssql import Connection, PoolConfig
+except ImportError:
+    # without fastmssql, load_to_sql() uploads through SQLAlchemy and pyodbc
+    Connection = None
+    import sqlalchemy
 
 from clean_inventory import clean_inventory_data
 from suppliers_sql import *
@@ -74,55 +81,128 @@ def validate(data, dtypes):
     
     # ensure datatypes match up to what was defined
     for column, dtype in zip(data.columns, data.dtypes.values):
-        logger.error('type="validation" | message="%s to %s"' % (column, str(dtype)))
-        assert dtypes[column] == dtype
+        if dtypes[column] != dtype:
+            logger.error('type="validation" | message="%s is %s, expected %s"' % (column, str(dtype), str(dtypes[column])))
+            raise AssertionError(column)
         
     print('Succesfully Validated Data.')
 
-def load(data, column_map):
-	"""
-	Main function to prepare database table and upload the data.
+def get_row_placeholders(row_count, column_count):
+    """
+    Creates the VALUES placeholders for a multi-row INSERT statement.
+    
+    Args:
+        row_count (int): defines the number of rows in the statement.
+        column_count (int): defines the number of columns in each row.
+    
+    Returns: str
+    """
+    rows = []
+    for row_index in range(row_count):
+        offset = row_index * column_count
+        rows.append(','.join(['@P%s' % (offset + index + 1) for index in range(column_count)]))
+        
+    return '), ('.join(rows)
+
+async def load(data, column_map):
+    """
+    Main function to prepare database table and upload the data.
     
     Args:
         data (pd.DataFrame): defines the data that is being validated.
-        database (str): defines database we are uploading to.
-        table (str): defines the table we are uploading to.
         column_map [(df.col, db.Col)]: Used to map pd.DataFrame column to respective column in the table.
         
     Returns: None
-	"""
-	connection_string = 'DRIVER={%s};SERVER=%s;DATABASE=%s;UID=%s;PWD=%s' % (DRIVER, HOST, DATABASE, USERNAME, PASSWORD)
-	conn = pyodbc.connect(connection_string)
-	cursor = conn.cursor()
+    """
+    connection_string = 'Server=%s;Database=%s;User Id=%s;Password=%s' % (HOST, DATABASE, USERNAME, PASSWORD)
 
-	print('Importing data into [%s].dbo.[%s]' % (database, table))
+    print('Importing data into [%s].dbo.[%s]' % (DATABASE, TABLE_NAME))
     
     # query parameters
     data_columns = [column[0] for column in column_map]
     table_columns = ['[%s]' % column[1] for column in column_map]
-    column_placeholders = ['?' for _ in table_columns]
+    rows_per_insert = min(max_insert_rows, max_insert_parameters // len(table_columns))
     
-    # truncate
-    try:
-        TRUNCATE_SQL = TRUNCATE_SQL % DATABASE
-        print(TRUNCATE_SQL)
-        cursor.execute(TRUNCATE_SQL)
-    except pyodbc.ProgrammingError as e:
-        logger.error('type="sql" | message="Unable to find table %s.dbo.%s"' % (DATABASE, TABLE_NAME))
-        raise Exception('Unable to find table %s.dbo.%s' % (DATABASE, TABLE_NAME))
+    # a single pooled connection, so the truncate and every insert run in one transaction
+    async with Connection(connection_string, pool_config=PoolConfig(max_size=1, min_idle=1)) as conn:
+        await conn.execute(BEGIN_TRANSACTION_SQL)
+        try:
+            # truncate
+            try:
+                truncate_sql = TRUNCATE_SQL % DATABASE
+                print(truncate_sql)
+                await conn.execute(truncate_sql)
+            except Exception as e:
+                logger.error('type="sql" | message="Unable to find table %s.dbo.%s"' % (DATABASE, TABLE_NAME))
+                raise Exception('Unable to find table %s.dbo.%s' % (DATABASE, TABLE_NAME))
+        
+            # insert, merging rows into multi-row statements
+            try:
+                # missing values are sent as None so they are written as NULL, as load_to_sql() does
+                insert_data = data[data_columns].astype(object)
+                insert_data = insert_data.where(data[data_columns].notna(), None)
+                insert_params = list(insert_data.itertuples(index=False, name=None))
+                print('Inserting %s rows, %s per statement.' % (len(insert_params), rows_per_insert))
+                
+                # the transaction is bound to one session, so statements are sent one at a time
+                for start in range(0, len(insert_params), rows_per_insert):
+                    rows = insert_params[start:start + rows_per_insert]
+                    insert_sql = INSERT_SQL % (DATABASE,
+                                               ', '.join(table_columns),
+                                               get_row_placeholders(len(rows), len(table_columns)),
+                                               )
+                    await conn.execute(insert_sql, [value for row in rows for value in row])
+            except Exception as e:
+                logger.error('type="sql" | message="Unable to import data into %s.dbo.%s"' % (DATABASE, TABLE_NAME))
+                raise Exception('Unable to import data into %s.dbo.%s' % (DATABASE, TABLE_NAME))
+        except Exception as e:
+            await conn.execute(ROLLBACK_TRANSACTION_SQL)
+            raise
+        
+        # commit
+        print('Committing Changes.')
+        await conn.execute(COMMIT_TRANSACTION_SQL)
+
+def load_to_sql(data, column_map):
+    """
+    Fallback to load() for environments without fastmssql, uploading through pandas.to_sql over SQLAlchemy.
+    
+    Args:
+        data (pd.DataFrame): defines the data that is being validated.
+        column_map [(df.col, db.Col)]: Used to map pd.DataFrame column to respective column in the table.
+        
+    Returns: None
+    """
+    
+    print('Importing data into [%s].dbo.[%s]' % (DATABASE, TABLE_NAME))
     
-    # insert
-    try:
-        insert_params = [tuple([row[column] for column in data_columns]) for _, row in data.to_dict(orient='index').items()]
-        INSERT_SQL = INSERT_SQL % (DATABASE, TABLE_NAME,
-                                  ', '.join(table_columns),
-                                  ','.join(column_placeholders),
-                                  )
-        print(INSERT_SQL)
-        cursor.executemany(INSERT_SQL, insert_params)
-    except pyodbc.ProgrammingError as e:
-        logger.error('type="sql" | message="Unable to import data into %s.dbo.%s"' % (database, table))
-        raise Exception('Unable to import data into %s.dbo.%s' % (database, table))
+    # query parameters
+    data_columns = [column[0] for column in column_map]
+    rows_per_insert = min(max_insert_rows, max_insert_parameters // len(column_map))
+    
+    with sa_engine.begin() as conn:
+        # truncate
+        try:
+            truncate_sql = TRUNCATE_SQL % DATABASE
+            print(truncate_sql)
+            conn.exec_driver_sql(truncate_sql)
+        except Exception as e:
+            logger.error('type="sql" | message="Unable to find table %s.dbo.%s"' % (DATABASE, TABLE_NAME))
+            raise Exception('Unable to find table %s.dbo.%s' % (DATABASE, TABLE_NAME))
+        
+        # insert, as multi-row statements built straight from the DataFrame columns,
+        # into the same [DATABASE].Inventory table that TRUNCATE_SQL and INSERT_SQL target
+        try:
+            data[data_columns].rename(columns=dict(column_map)).to_sql('Inventory', conn, schema=DATABASE, if_exists='append',
+                                                                       index=False, method='multi',
+                                                                       chunksize=rows_per_insert)
+        except Exception as e:
+            logger.error('type="sql" | message="Unable to import data into %s.dbo.%s"' % (DATABASE, TABLE_NAME))
+            raise Exception('Unable to import data into %s.dbo.%s' % (DATABASE, TABLE_NAME))
+
+# SQL Server allows at most 2100 parameters and 1000 VALUES rows per statement
+max_insert_parameters = 2000
+max_insert_rows = 1000
 
 logger = configure_logging(path_to_log_directory='logs/')
 
@@ -142,6 +222,12 @@ except KeyError as e:
     logger.error('type="ENV_VARIABLE" | message="Failed to get %s"' % e)
     raise Exception(e)
 
+# fallback engine for load_to_sql()
+if Connection is None:
+    odbc_connection_string = 'DRIVER={%s};SERVER=%s;DATABASE=%s;UID=%s;PWD=%s' % (DRIVER, HOST, DATABASE, USERNAME, PASSWORD)
+    sa_engine = sqlalchemy.create_engine('mssql+pyodbc:///?odbc_connect=' + quote_plus(odbc_connection_string),
+                                         fast_executemany=True)
+
 if __name__ == '__main__':
 	data = get_inventory_data()
 	dtypes = {
@@ -161,6 +247,9 @@ if __name__ == '__main__':
                   ('source', 'Source'),
                  ]
 
-	load(data, column_map)
+	if Connection is None:
+		load_to_sql(data, column_map)
+	else:
+		asyncio.run(load(data, column_map))
 
 
@@ -27,3 +27,15 @@ SET
     e.Quantity = b.Quantity
 """
 
+BEGIN_TRANSACTION_SQL = """
+SET XACT_ABORT ON;
+BEGIN TRANSACTION;
+"""
+
+COMMIT_TRANSACTION_SQL = """
+COMMIT TRANSACTION;
+"""
+
+ROLLBACK_TRANSACTION_SQL = """
+IF @@TRANCOUNT > 0 ROLLBACK TRANSACTION;
+"""